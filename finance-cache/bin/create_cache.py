@@ -15,14 +15,20 @@ from finance_cache.finance_cache import FinanceCache
     help="The start date of price history that the cache will load. It will not"
          " attempt to load or store data older than this date.",
 )
-def create_cache(cache_path: Path, history_start: date):
+@click.option(
+    "--num_shards",
+    default=1,
+    type=click.IntRange(min=1),
+    help="The number of Sqlite databases that tickers are partitioned across.",
+)
+def create_cache(cache_path: Path, history_start: date, num_shards: int):
     """
     Creates an instance of the finance cache with the specified options.
 
     CACHE_PATH: The directory where the data loaded by the cache will live.
       This directory will be created and must not already exist.
     """
-    FinanceCache.create(cache_path, CacheConfig(history_start))
+    FinanceCache.create(cache_path, CacheConfig(history_start, num_shards))
     click.echo("Success.")
 
 
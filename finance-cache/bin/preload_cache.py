@@ -32,10 +32,13 @@ def preload_cache(cache_path: Path, tickers_file: Path):
     click.echo(f"Received {len(tickers)} tickers to load.")
     start_time = datetime.now()
     cache = FinanceCache(cache_path)
-    for ticker in tickers:
-        # TODO: catch exception, e.g. ticker not found
-        cache.load(ticker)
-    click.echo(f"Finished in {(datetime.now() - start_time).seconds} seconds.")
+    stats = cache.load_many(tickers)
+    for ticker, error in stats.failed.items():
+        click.echo(f"Failed to load {ticker}: {error}")
+    click.echo(
+        f"Finished in {(datetime.now() - start_time).seconds} seconds, using "
+        f"{stats.num_requests} requests to add {stats.num_days_added} days of data."
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,39 @@
+from datetime import timedelta
+from pathlib import Path
+
+import click
+from finance_cache.finance_cache import FinanceCache
+from finance_cache.refresh import RefreshScheduler
+
+
+@click.command()
+@click.argument(
+    "cache_path", type=click.Path(file_okay=False, dir_okay=True, path_type=Path)
+)
+@click.option(
+    "--max_age_hours",
+    default=12,
+    type=float,
+    help="Tickers are refreshed once their data is older than this.",
+)
+@click.option(
+    "--cycle_seconds",
+    default=300,
+    type=int,
+    help="How often to check for tickers that need to be refreshed.",
+)
+def refresh_cache(cache_path: Path, max_age_hours: float, cycle_seconds: int):
+    """
+    Runs forever, keeping the FinanceCache fresh. Tickers that are read most
+    often are refreshed first.
+    """
+    scheduler = RefreshScheduler(
+        FinanceCache(cache_path),
+        cache_path / "refresh_state.json",
+        max_age=timedelta(hours=max_age_hours),
+    )
+    scheduler.run(timedelta(seconds=cycle_seconds))
+
+
+if __name__ == "__main__":
+    refresh_cache()
@@ -0,0 +1,26 @@
+from datetime import datetime
+from pathlib import Path
+
+import click
+from finance_cache.finance_cache import FinanceCache
+
+
+@click.command()
+@click.argument(
+    "cache_path", type=click.Path(file_okay=False, dir_okay=True, path_type=Path)
+)
+@click.argument("num_shards", type=click.IntRange(min=1))
+def reshard_cache(cache_path: Path, num_shards: int):
+    """
+    Changes the number of Sqlite databases that the FinanceCache is
+    partitioned into. The cache must not be in use while this runs.
+
+    NUM_SHARDS: The new number of databases.
+    """
+    start_time = datetime.now()
+    FinanceCache.reshard(cache_path, num_shards)
+    click.echo(f"Finished in {(datetime.now() - start_time).seconds} seconds.")
+
+
+if __name__ == "__main__":
+    reshard_cache()
@@ -1,7 +1,7 @@
 from dataclasses import dataclass
 from datetime import date
 
-from marshmallow import Schema, fields, post_load
+from marshmallow import Schema, fields, post_load, validate
 
 
 @dataclass(frozen=True)
@@ -11,12 +11,17 @@ class CacheConfig:
     # The start date of price history that the cache will load. It will not
     # attempt to load or store data older than this date.
     history_start: date
+    # The number of Sqlite databases that tickers are hash-partitioned across.
+    # Use `FinanceCache.reshard()` to change it for an existing cache.
+    num_shards: int = 1
 
 
 class CacheConfigSchema(Schema):
     """Marshmallow schema used to validate a `CacheConfig` instance."""
 
     history_start = fields.Date(required=True)
+    # Caches created before sharding was introduced have a single shard.
+    num_shards = fields.Integer(load_default=1, validate=validate.Range(min=1))
 
     @post_load
     def make_config(self, data, **kwargs) -> CacheConfig:
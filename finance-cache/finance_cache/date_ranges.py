@@ -0,0 +1,78 @@
+from datetime import date, timedelta
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+# An inclusive range of days: (first day, last day).
+DateRange = Tuple[date, date]
+
+# A gap between two days with data is only considered missing data if it
+# spans more business days than this, since markets close on holidays.
+MAX_HOLIDAY_BUSINESS_DAYS = 1
+
+_ONE_DAY = timedelta(days=1)
+
+
+def _num_business_days(date_range: DateRange) -> int:
+    return int(np.busday_count(date_range[0], date_range[1] + _ONE_DAY))
+
+
+def merge_ranges(ranges: Iterable[DateRange]) -> List[DateRange]:
+    """Returns the union of `ranges` as sorted ranges that don't touch."""
+    merged: List[DateRange] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + _ONE_DAY:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract_ranges(
+    ranges: Iterable[DateRange], to_remove: Iterable[DateRange]
+) -> List[DateRange]:
+    """Returns the days in `ranges` that are not in `to_remove`, as ranges."""
+    to_remove = merge_ranges(to_remove)
+    result: List[DateRange] = []
+    for start, end in merge_ranges(ranges):
+        for remove_start, remove_end in to_remove:
+            if remove_end < start or remove_start > end:
+                continue
+            if remove_start > start:
+                result.append((start, remove_start - _ONE_DAY))
+            start = remove_end + _ONE_DAY
+        if start <= end:
+            result.append((start, end))
+    return result
+
+
+def find_missing_ranges(
+    stored_days: List[date],
+    fetched_ranges: List[DateRange],
+    start_date: date,
+    end_date: date,
+) -> List[DateRange]:
+    """
+    Returns the ranges between `start_date` and `end_date` inclusive that
+    should be fetched, given the sorted days that data is stored for and the
+    ranges that have already been fetched.
+
+    Gaps in the stored days of up to `MAX_HOLIDAY_BUSINESS_DAYS` business days
+    are not considered missing, except at the end: the most recent days are
+    always fetched until they have been fetched once.
+    """
+    stored_days = [d for d in stored_days if start_date <= d <= end_date]
+    # Sentinels so that the head and tail are handled like any other gap.
+    bounds = [start_date - _ONE_DAY] + stored_days + [end_date + _ONE_DAY]
+    gaps: List[DateRange] = []
+    for before, after in zip(bounds, bounds[1:]):
+        gap = (before + _ONE_DAY, after - _ONE_DAY)
+        if gap[0] > gap[1]:
+            continue
+        is_tail = after > end_date
+        tolerance = 0 if is_tail else MAX_HOLIDAY_BUSINESS_DAYS
+        if _num_business_days(gap) > tolerance:
+            gaps.append(gap)
+    return [
+        r for r in subtract_ranges(gaps, fetched_ranges) if _num_business_days(r) > 0
+    ]
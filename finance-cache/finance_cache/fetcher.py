@@ -52,6 +52,12 @@ class YFinanceFetcher:
         """
         self._limiter = Limiter(max_qps)
         self._acquire_timeout = max_wait
+        self._num_requests = 0
+
+    @property
+    def num_requests(self) -> int:
+        """The number of requests made against the rate limit so far."""
+        return self._num_requests
 
     def fetch_stock_info(self, ticker: str) -> StockInfo:
         """
@@ -66,6 +72,7 @@ class YFinanceFetcher:
             # Unfortunately the API does not provide a more elegant way to block.
             try:
                 self._limiter.try_acquire("lock")
+                self._num_requests += 1
                 yticker = yfinance.Ticker(ticker)
                 return StockInfo(
                     ticker=yticker.info["symbol"],
@@ -95,14 +102,22 @@ class YFinanceFetcher:
         known to Yahoo! Finance). Raises MaxWaitExceeded error if the request
         could not be made within the configured `max_wait`.
         """
-        if start_date == end_date:
+        if start_date > end_date:
             return []
         deadline = datetime.now() + self._acquire_timeout
         while datetime.now() < deadline:
             try:
                 self._limiter.try_acquire("lock")
+                self._num_requests += 1
                 yticker = yfinance.Ticker(ticker)
-                history = yticker.history(start=start_date, end=end_date)
+                # Note: `end` is exclusive. Prices are adjusted for splits and
+                # dividends, which all data in the cache must agree on.
+                history = yticker.history(
+                    start=start_date,
+                    end=end_date + timedelta(days=1),
+                    auto_adjust=True,
+                    actions=False,
+                )
                 # Note: I added a filter to double-check we don't return data
                 # outside [start_date, end_date]. I've noticed yfinance may
                 # return data that is outside of the range by a day.
@@ -1,14 +1,39 @@
+import atexit
+import bisect
+import dataclasses
 import json
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, timedelta
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Callable, Dict, Iterable, List, TypeVar
 
 from finance_cache.config import CacheConfig, CacheConfigSchema
+from finance_cache.date_ranges import (DateRange, find_missing_ranges,
+                                       merge_ranges)
 from finance_cache.fetcher import YFinanceFetcher
-from finance_cache.models import Base, MarketDataModel, StockModel
-from finance_cache.public_models import PriceHistory
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session, sessionmaker
+from finance_cache.models import (FetchedRangeModel, MarketDataModel,
+                                  StockModel, TickerAccessModel)
+from finance_cache.price_series import PriceSeries
+from finance_cache.public_models import (CoalescingStats, LoadStats,
+                                         PriceHistory, TickerAccess)
+from finance_cache.shard import Shard, get_shard_index
+from finance_cache.single_flight import SingleFlight
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+T = TypeVar("T")
+U = TypeVar("U")
+
+# Number of threads used to read from several shards in parallel.
+MAX_READ_THREADS = 32
+# Reads recorded by `record_access()` are buffered in memory and written to
+# the database at most this often.
+ACCESS_FLUSH_INTERVAL = timedelta(minutes=1)
+# Reads of further tickers are dropped while this many are buffered.
+MAX_PENDING_ACCESSES = 10000
 
 
 class FinanceCache:
@@ -25,13 +50,6 @@ class FinanceCache:
         if not base_path.is_dir():
             raise ValueError(f"The provided path must be a directory: {base_path}.")
 
-        db_path = self._make_db_path(base_path)
-        if not db_path.exists():
-            raise ValueError(
-                f"Could not find a database in the directory. "
-                f"Expected to find one at {db_path}."
-            )
-
         config_path = self._make_config_path(base_path)
         if not config_path.exists():
             raise ValueError(
@@ -42,9 +60,30 @@ class FinanceCache:
         with open(config_path) as cfg_file:
             self._config = CacheConfigSchema().load(json.load(cfg_file))
 
-        self._engine = create_engine(f"sqlite:///{db_path}")
-        self._session_maker = sessionmaker(bind=self._engine)
+        num_shards = self._config.num_shards
+        db_paths = [
+            self._make_db_path(base_path, i, num_shards) for i in range(num_shards)
+        ]
+        for db_path in db_paths:
+            if not db_path.exists():
+                raise ValueError(
+                    f"Could not find a database in the directory. "
+                    f"Expected to find one at {db_path}."
+                )
+        self._shards = [Shard(db_path) for db_path in db_paths]
+        # Used to read from several shards in parallel. It is shared by all
+        # concurrent callers, so it is not sized by the number of shards.
+        self._executor = ThreadPoolExecutor(max_workers=MAX_READ_THREADS)
         self._fetcher = YFinanceFetcher()
+        # Coalesce concurrent identical reads and loads.
+        self._reads = SingleFlight()
+        self._loads = SingleFlight()
+        # Reads that have not been written to the database yet.
+        self._access_lock = threading.Lock()
+        self._pending_accesses: Dict[str, TickerAccess] = {}
+        self._last_access_flush = datetime.now()
+        # Write the reads that are still buffered when the process exits.
+        atexit.register(self.flush_accesses)
 
     @staticmethod
     def create(base_path: Path, config: CacheConfig):
@@ -59,20 +98,128 @@ class FinanceCache:
             raise ValueError(f"The provided config has the following issues: {errors}")
         base_path.mkdir()
 
-        # Create database.
-        engine = create_engine(
-            f"sqlite:///{FinanceCache._make_db_path(base_path).absolute()}"
-        )
-        Base.metadata.create_all(engine)
+        # Create databases.
+        for i in range(config.num_shards):
+            Shard(FinanceCache._make_db_path(base_path, i, config.num_shards)).dispose()
 
         # Write out config.
         with open(FinanceCache._make_config_path(base_path), "w+") as out:
             json.dump(CacheConfigSchema().dump(config), out, indent=4)
 
     @staticmethod
-    def _make_db_path(base_path: Path) -> Path:
-        """Returns the path to where the Sqlite file is expected. `base_path` is the FinanceCache instance directory."""
-        return base_path / "finance_cache.sqlite"
+    def reshard(base_path: Path, num_shards: int):
+        """
+        Changes the number of shards of the FinanceCache instance in the
+        specified directory, moving every stock to the shard it hashes to.
+        The cache must not be in use while this runs.
+        """
+        cache = FinanceCache(base_path)
+        old_config = cache._config
+        if num_shards == old_config.num_shards:
+            return
+        new_config = dataclasses.replace(old_config, num_shards=num_shards)
+        errors = CacheConfigSchema().validate(CacheConfigSchema().dump(new_config))
+        if errors:
+            raise ValueError(f"The new config has the following issues: {errors}")
+
+        new_paths = [
+            FinanceCache._make_db_path(base_path, i, num_shards)
+            for i in range(num_shards)
+        ]
+        # Remove files left behind by an interrupted attempt.
+        for db_path in new_paths:
+            db_path.unlink(missing_ok=True)
+        new_shards = [Shard(db_path) for db_path in new_paths]
+
+        for old_shard in cache._shards:
+            with old_shard.session_maker() as source:
+                for stock in source.query(StockModel).all():
+                    new_shard = new_shards[get_shard_index(stock.ticker, num_shards)]
+                    with new_shard.session_maker() as dest:
+                        FinanceCache._copy_stock(source, dest, stock)
+                        dest.commit()
+                accesses = source.query(TickerAccessModel).all()
+                for access in accesses:
+                    new_shard = new_shards[get_shard_index(access.ticker, num_shards)]
+                    with new_shard.session_maker() as dest:
+                        dest.add(
+                            TickerAccessModel(
+                                ticker=access.ticker,
+                                num_reads=access.num_reads,
+                                last_read=access.last_read,
+                            )
+                        )
+                        dest.commit()
+
+        # Switch over by writing the new config, then remove the old files.
+        with open(FinanceCache._make_config_path(base_path), "w+") as out:
+            json.dump(CacheConfigSchema().dump(new_config), out, indent=4)
+        for shard in cache._shards + new_shards:
+            shard.dispose()
+        for shard in cache._shards:
+            shard.db_path.unlink()
+
+    @staticmethod
+    def _copy_stock(source: Session, dest: Session, stock: StockModel):
+        """Copies `stock` and all of its data from `source` to `dest`."""
+        new_stock = StockModel(
+            ticker=stock.ticker,
+            name=stock.name,
+            quote_type=stock.quote_type,
+            description=stock.description,
+        )
+        dest.add(new_stock)
+        # Flush to ensure `new_stock` gets an ID primary key assigned.
+        dest.flush()
+        market_data = [
+            {
+                "stock_id": new_stock.id,
+                "day": r.day,
+                "open_price": r.open_price,
+                "close_price": r.close_price,
+            }
+            for r in source.query(MarketDataModel).where(
+                MarketDataModel.stock_id == stock.id
+            )
+        ]
+        if market_data:
+            dest.execute(insert(MarketDataModel), market_data)
+        fetched_ranges = [
+            {"stock_id": new_stock.id, "start_day": r.start_day, "end_day": r.end_day}
+            for r in source.query(FetchedRangeModel).where(
+                FetchedRangeModel.stock_id == stock.id
+            )
+        ]
+        if fetched_ranges:
+            dest.execute(insert(FetchedRangeModel), fetched_ranges)
+
+    @staticmethod
+    def _make_db_path(base_path: Path, shard: int = 0, num_shards: int = 1) -> Path:
+        """Returns the path to where the Sqlite file of `shard` is expected. `base_path` is the FinanceCache instance directory."""
+        if num_shards == 1:
+            return base_path / "finance_cache.sqlite"
+        # Include the number of shards so that resharding never overwrites
+        # the current files.
+        return base_path / f"finance_cache.{shard}-of-{num_shards}.sqlite"
+
+    def _get_shard(self, ticker: str) -> Shard:
+        return self._shards[get_shard_index(ticker, len(self._shards))]
+
+    def _map_shards(self, fn: Callable[[Shard], T]) -> List[T]:
+        """Returns `fn(shard)` for every shard, evaluated in parallel."""
+        return self._map_in_parallel(fn, self._shards)
+
+    def _map_in_parallel(self, fn: Callable[[U], T], items: List[U]) -> List[T]:
+        """
+        Returns `fn(item)` for every item. The first item is evaluated by the
+        calling thread while the others are evaluated on the thread pool, so
+        that a single item never waits for the pool.
+        """
+        if not items:
+            return []
+        futures = [self._executor.submit(fn, item) for item in items[1:]]
+        first = fn(items[0])
+        return [first] + [future.result() for future in futures]
 
     @staticmethod
     def _make_config_path(base_path: Path) -> Path:
@@ -80,7 +227,7 @@ class FinanceCache:
         return base_path / "config.json"
 
     def knows_ticker(self, ticker: str) -> bool:
-        with self._session_maker() as session:
+        with self._get_shard(ticker).session_maker() as session:
             find_stock = session.query(StockModel).filter(
                 StockModel.ticker == ticker.upper()
             )
@@ -92,8 +239,20 @@ class FinanceCache:
         """
         Returns price history from `start_date` inclusive until `end_date`
         inclusive for the specified ticker, ordered by date increasing.
+
+        Concurrent calls with the same arguments share a single query.
         """
-        with self._session_maker() as session:
+        history = self._reads.do(
+            (ticker, start_date, end_date),
+            lambda: self._query_price_history(ticker, start_date, end_date),
+        )
+        # Each caller gets its own dict, so that they can't affect each other.
+        return dict(history)
+
+    def _query_price_history(
+        self, ticker: str, start_date: date, end_date: date
+    ) -> Dict[date, PriceHistory]:
+        with self._get_shard(ticker).session_maker() as session:
             res = (
                 session.query(MarketDataModel)
                 .join(StockModel)
@@ -108,50 +267,276 @@ class FinanceCache:
                 return {r.day: r.to_price_history() for r in res}
         raise ValueError(f"No data for {ticker}.")
 
-    def load(self, ticker: str):
-        """Loads data for the specified stock into the cache. This is slow."""
-        print(f"Loading data for {ticker}.")
-        session: Session
-        with self._session_maker() as session:
-            stock: Optional[StockModel] = (
-                session.query(StockModel).filter(StockModel.ticker == ticker).first()
+    def get_price_series(
+        self, tickers: Iterable[str], start_date: date, end_date: date
+    ) -> Dict[str, PriceSeries]:
+        """
+        Returns {ticker -> PriceSeries} from `start_date` inclusive until
+        `end_date` inclusive for each of the specified tickers, for as-of
+        lookups.
+
+        Raises ValueError if there is no data for one of the tickers.
+        """
+        tickers = list(tickers)
+        by_shard: Dict[int, List[str]] = defaultdict(list)
+        for ticker in tickers:
+            by_shard[get_shard_index(ticker, len(self._shards))].append(ticker)
+
+        def read_shard(shard_tickers: List[str]) -> Dict[str, Dict[date, PriceHistory]]:
+            return {
+                ticker: self.get_price_history(ticker, start_date, end_date)
+                for ticker in shard_tickers
+            }
+
+        # Tickers on different shards are read in parallel. The calling thread
+        # reads the largest group itself.
+        groups = sorted(by_shard.values(), key=len, reverse=True)
+        histories = {}
+        for shard_histories in self._map_in_parallel(read_shard, groups):
+            histories.update(shard_histories)
+        return {
+            ticker: PriceSeries.from_history(histories[ticker]) for ticker in tickers
+        }
+
+    def get_tickers(self) -> List[str]:
+        """Returns the tickers of all stocks that have been loaded."""
+
+        def get_shard_tickers(shard: Shard) -> List[str]:
+            with shard.session_maker() as session:
+                return [r.ticker for r in session.query(StockModel.ticker).all()]
+
+        return [t for tickers in self._map_shards(get_shard_tickers) for t in tickers]
+
+    def record_access(self, tickers: Iterable[str]):
+        """
+        Records that the specified tickers were read by a user of the cache.
+        This is used to prioritize which tickers to keep fresh.
+
+        Reads are buffered in memory, and written by the first call after
+        `ACCESS_FLUSH_INTERVAL` has passed and when the process exits. This is
+        best-effort: it never raises, reads of tickers that the cache doesn't
+        know are not recorded, and reads are lost if the process is killed.
+        """
+        now = datetime.now()
+        with self._access_lock:
+            for ticker in tickers:
+                ticker = ticker.upper()
+                pending = self._pending_accesses.get(ticker)
+                if pending:
+                    pending.num_reads += 1
+                    pending.last_read = now
+                elif len(self._pending_accesses) < MAX_PENDING_ACCESSES:
+                    self._pending_accesses[ticker] = TickerAccess(ticker, 1, now)
+            if now - self._last_access_flush < ACCESS_FLUSH_INTERVAL:
+                return
+        self.flush_accesses()
+
+    def flush_accesses(self):
+        """Writes the reads buffered by `record_access()` to the database."""
+        with self._access_lock:
+            accesses = self._pending_accesses
+            self._pending_accesses = {}
+            self._last_access_flush = datetime.now()
+        by_shard: Dict[int, List[TickerAccess]] = defaultdict(list)
+        for access in accesses.values():
+            by_shard[get_shard_index(access.ticker, len(self._shards))].append(access)
+        for index, shard_accesses in by_shard.items():
+            try:
+                self._write_accesses(self._shards[index], shard_accesses)
+            except Exception as e:
+                print(f"Failed to record reads of {len(shard_accesses)} tickers: {e}")
+
+    @staticmethod
+    def _write_accesses(shard: Shard, accesses: List[TickerAccess]):
+        with shard.write_lock, shard.session_maker() as session:
+            known = set(
+                r.ticker
+                for r in session.query(StockModel.ticker).where(
+                    StockModel.ticker.in_([a.ticker for a in accesses])
+                )
             )
-            if not stock:
-                # Load information about the stock.
-                stock_info = self._fetcher.fetch_stock_info(ticker)
-                stock = StockModel(
-                    ticker=ticker,
-                    name=stock_info.name,
-                    quote_type=stock_info.quote_type,
-                    description=stock_info.description,
+            for access in accesses:
+                if access.ticker not in known:
+                    continue
+                upsert = insert(TickerAccessModel).values(
+                    ticker=access.ticker,
+                    num_reads=access.num_reads,
+                    last_read=access.last_read,
                 )
-                session.add(stock)
-                # Flush to ensure `stock` gets an ID primary key assigned.
-                session.flush()
+                session.execute(
+                    upsert.on_conflict_do_update(
+                        index_elements=[TickerAccessModel.ticker],
+                        set_={
+                            "num_reads": TickerAccessModel.num_reads + access.num_reads,
+                            "last_read": access.last_read,
+                        },
+                    )
+                )
+            session.commit()
 
-            # Don't fetch data for days that we already have in the database.
-            freshest_market_data: Optional[MarketDataModel] = (
-                session.query(MarketDataModel)
-                .where(MarketDataModel.stock_id == stock.id)
-                .order_by(MarketDataModel.day.desc())
-                .first()
+    def get_access_counts(self) -> Dict[str, TickerAccess]:
+        """Returns {ticker -> TickerAccess} for every ticker that was read."""
+
+        def get_shard_access_counts(shard: Shard) -> List[TickerAccess]:
+            with shard.session_maker() as session:
+                return [
+                    r.to_ticker_access() for r in session.query(TickerAccessModel).all()
+                ]
+
+        return {
+            access.ticker: access
+            for accesses in self._map_shards(get_shard_access_counts)
+            for access in accesses
+        }
+
+    def load(self, ticker: str) -> LoadStats:
+        """
+        Loads data for the specified stock into the cache. This is slow.
+
+        Raises the error that occurred if the stock could not be loaded.
+        """
+        stats = self.load_many([ticker])
+        if ticker in stats.failed:
+            raise stats.failed[ticker]
+        return stats
+
+    def load_many(self, tickers: Iterable[str]) -> LoadStats:
+        """
+        Loads data for the specified stocks into the cache, one at a time.
+        This is slow.
+
+        Concurrent loads of the same ticker share a single fetch and commit,
+        also across calls with different sets of tickers. Tickers that could
+        not be loaded are reported in the returned stats rather than raised.
+        """
+        tickers = sorted(set(tickers))
+        num_requests_before = self._fetcher.num_requests
+        failed: Dict[str, Exception] = {}
+        num_days_added = 0
+        # Only fetch complete days.
+        end_date = datetime.now().date() - timedelta(days=1)
+        for ticker in tickers:
+            try:
+                num_days_added += self._loads.do(
+                    ticker.upper(), lambda: self._load_ticker(ticker, end_date)
+                )
+            except Exception as e:
+                failed[ticker] = e
+        return LoadStats(
+            num_tickers=len(tickers),
+            num_requests=self._fetcher.num_requests - num_requests_before,
+            num_days_added=num_days_added,
+            failed=failed,
+        )
+
+    def get_coalescing_stats(self) -> Dict[str, CoalescingStats]:
+        """
+        Returns how many reads and loads were coalesced with a concurrent
+        identical call, keyed by "reads" and "loads".
+        """
+        return {"reads": self._reads.stats(), "loads": self._loads.stats()}
+
+    def _get_or_create_stock(self, shard: Shard, ticker: str) -> int:
+        """Returns the ID of the stock, fetching its information if it is new."""
+        with shard.session_maker() as session:
+            stock_id = session.scalar(
+                select(StockModel.id).where(StockModel.ticker == ticker)
             )
-            start_date = (
-                freshest_market_data.day + timedelta(days=1)
-                if freshest_market_data
-                else self._config.history_start
+        if stock_id is not None:
+            return stock_id
+        # Fetch before writing, so that the database isn't locked while
+        # waiting for the rate limit.
+        stock_info = self._fetcher.fetch_stock_info(ticker)
+        with shard.write_lock, shard.session_maker() as session:
+            stock = StockModel(
+                ticker=ticker,
+                name=stock_info.name,
+                quote_type=stock_info.quote_type,
+                description=stock_info.description,
             )
+            session.add(stock)
+            # Flush to ensure `stock` gets an ID primary key assigned.
+            session.flush()
+            stock_id = stock.id
+            session.commit()
+        return stock_id
 
-            market_data = self._fetcher.fetch_market_data(
-                ticker, start_date, datetime.now().date()
+    @staticmethod
+    def _add_fetched_range(session: Session, stock_id: int, fetched: DateRange):
+        """Records that `fetched` was fetched, merging it with earlier ranges."""
+        existing = (
+            session.query(FetchedRangeModel)
+            .where(FetchedRangeModel.stock_id == stock_id)
+            .all()
+        )
+        merged = merge_ranges([(r.start_day, r.end_day) for r in existing] + [fetched])
+        for r in existing:
+            session.delete(r)
+        for start_day, end_day in merged:
+            session.add(
+                FetchedRangeModel(
+                    stock_id=stock_id, start_day=start_day, end_day=end_day
+                )
             )
-            for day in market_data:
-                session.add(
-                    MarketDataModel(
-                        stock_id=stock.id,
-                        day=day.day,
-                        open_price=day.open_price,
-                        close_price=day.close_price,
-                    )
+
+    def _load_ticker(self, ticker: str, end_date: date) -> int:
+        """
+        Loads the data that the stock is missing until `end_date` inclusive,
+        with at most one request for its market data. Returns the number of
+        days of data added.
+        """
+        print(f"Loading data for {ticker}.")
+        shard = self._get_shard(ticker)
+        stock_id = self._get_or_create_stock(shard, ticker)
+        with shard.session_maker() as session:
+            days = list(
+                session.scalars(
+                    select(MarketDataModel.day)
+                    .where(MarketDataModel.stock_id == stock_id)
+                    .order_by(MarketDataModel.day)
+                )
+            )
+            fetched = [
+                (r.start_day, r.end_day)
+                for r in session.query(FetchedRangeModel).where(
+                    FetchedRangeModel.stock_id == stock_id
+                )
+            ]
+        missing = find_missing_ranges(
+            days, fetched, self._config.history_start, end_date
+        )
+        if not missing:
+            return 0
+
+        # Fetch the range that covers every missing range in a single request.
+        # Start at the last day stored before it, if any, so that a request
+        # that succeeds always returns data: yfinance returns nothing rather
+        # than raising when a request fails.
+        fetch_start = missing[0][0]
+        earlier = bisect.bisect_left(days, fetch_start)
+        if earlier > 0:
+            fetch_start = days[earlier - 1]
+        fetch_range = (fetch_start, missing[-1][1])
+        market_data = self._fetcher.fetch_market_data(ticker, *fetch_range)
+        if not market_data:
+            raise ValueError(
+                f"No market data was returned for {ticker} between "
+                f"{fetch_range[0]} and {fetch_range[1]}."
+            )
+
+        stored_days = set(days)
+        # The range may overlap days that are already stored.
+        new_data = [d for d in market_data if d.day not in stored_days]
+        with shard.write_lock, shard.session_maker() as session:
+            session.add_all(
+                MarketDataModel(
+                    stock_id=stock_id,
+                    day=d.day,
+                    open_price=d.open_price,
+                    close_price=d.close_price,
                 )
+                for d in new_data
+            )
+            self._add_fetched_range(session, stock_id, fetch_range)
             session.commit()
+        return len(new_data)
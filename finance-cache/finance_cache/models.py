@@ -1,8 +1,9 @@
-from datetime import date
+from datetime import date, datetime
 from typing import List
 
-from finance_cache.public_models import PriceHistory
-from sqlalchemy import Date, Float, ForeignKey, String, UniqueConstraint
+from finance_cache.public_models import PriceHistory, TickerAccess
+from sqlalchemy import (Date, DateTime, Float, ForeignKey, Integer, String,
+                        UniqueConstraint)
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -54,3 +55,47 @@ class MarketDataModel(Base):
             f"PriceHistory(id={self.id}, ticker_id={self.stock_id}, "
             f"day={self.day}, open={self.open_price}, close={self.close_price})"
         )
+
+
+class TickerAccessModel(Base):
+    """How often a ticker has been read by users of the cache."""
+
+    __tablename__ = "ticker_access"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    # Not a foreign key: tickers may be read before they have been loaded.
+    ticker: Mapped[str] = mapped_column(String(20), unique=True, index=True)
+    num_reads: Mapped[int] = mapped_column(Integer)
+    last_read: Mapped[datetime] = mapped_column(DateTime)
+
+    def to_ticker_access(self) -> TickerAccess:
+        return TickerAccess(
+            ticker=self.ticker,
+            num_reads=self.num_reads,
+            last_read=self.last_read,
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"TickerAccess(ticker={self.ticker}, num_reads={self.num_reads}, "
+            f"last_read={self.last_read})"
+        )
+
+
+class FetchedRangeModel(Base):
+    """
+    A range of days that market data has been fetched for, for a single
+    stock. Days in the range without market data have no data available.
+    """
+
+    __tablename__ = "fetched_range"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    stock_id: Mapped[int] = mapped_column(ForeignKey("stock.id"), index=True)
+    # Both inclusive.
+    start_day: Mapped[date] = mapped_column(Date)
+    end_day: Mapped[date] = mapped_column(Date)
+
+    def __repr__(self) -> str:
+        return (
+            f"FetchedRange(stock_id={self.stock_id}, start_day={self.start_day}, "
+            f"end_day={self.end_day})"
+        )
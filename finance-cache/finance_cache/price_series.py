@@ -0,0 +1,73 @@
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+from finance_cache.public_models import PriceHistory
+
+
+@dataclass(frozen=True)
+class PriceSeries:
+    """
+    Price history of a single ticker, stored as arrays sorted by day so that
+    "as-of" lookups take O(log n).
+
+    `days` holds date ordinals (see `date.toordinal()`), and `open`/`close`
+    hold the prices on the day at the same position.
+    """
+
+    days: np.ndarray
+    open: np.ndarray
+    close: np.ndarray
+
+    @staticmethod
+    def from_history(history: Dict[date, PriceHistory]) -> "PriceSeries":
+        ordered = sorted(history.values(), key=lambda h: h.day)
+        return PriceSeries(
+            np.array([h.day.toordinal() for h in ordered], dtype=np.int64),
+            np.array([h.open for h in ordered], dtype=np.float64),
+            np.array([h.close for h in ordered], dtype=np.float64),
+        )
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def at(self, position: int) -> PriceHistory:
+        """Returns the price history at `position` in the series."""
+        return PriceHistory(
+            day=date.fromordinal(int(self.days[position])),
+            open=float(self.open[position]),
+            close=float(self.close[position]),
+        )
+
+    def on_or_after(self, day: date) -> Optional[PriceHistory]:
+        """Returns the first price on or after `day`, or None if there isn't one."""
+        position = bisect_left(self.days, day.toordinal())
+        return self.at(position) if position < len(self.days) else None
+
+    def on_or_before(self, day: date) -> Optional[PriceHistory]:
+        """Returns the last price on or before `day`, or None if there isn't one."""
+        position = bisect_right(self.days, day.toordinal()) - 1
+        return self.at(position) if position >= 0 else None
+
+    def positions_on_or_after(self, days: Iterable[int]) -> np.ndarray:
+        """
+        Batch version of `on_or_after`. Takes date ordinals and returns the
+        position of the first price on or after each of them, or -1 if there
+        isn't one.
+        """
+        positions = np.searchsorted(self.days, np.asarray(days, dtype=np.int64))
+        positions[positions == len(self.days)] = -1
+        return positions
+
+    def positions_on_or_before(self, days: Iterable[int]) -> np.ndarray:
+        """
+        Batch version of `on_or_before`. Takes date ordinals and returns the
+        position of the last price on or before each of them, or -1 if there
+        isn't one.
+        """
+        return (
+            np.searchsorted(self.days, np.asarray(days, dtype=np.int64), side="right")
+            - 1
+        )
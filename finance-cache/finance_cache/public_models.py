@@ -1,5 +1,6 @@
 from dataclasses import dataclass
-from datetime import date
+from datetime import date, datetime
+from typing import Dict
 
 
 @dataclass
@@ -7,3 +8,30 @@ class PriceHistory:
     day: date
     open: float
     close: float
+
+
+@dataclass
+class TickerAccess:
+    ticker: str
+    num_reads: int
+    last_read: datetime
+
+
+@dataclass
+class CoalescingStats:
+    # Number of calls that were actually made.
+    num_calls: int
+    # Number of callers that shared the result of a call already in flight.
+    num_coalesced: int
+
+
+@dataclass
+class LoadStats:
+    # Number of tickers that were loaded.
+    num_tickers: int
+    # Number of requests made against the fetcher's rate limit.
+    num_requests: int
+    # Number of days of market data added to the cache.
+    num_days_added: int
+    # Tickers that could not be loaded -> the error that occurred.
+    failed: Dict[str, Exception]
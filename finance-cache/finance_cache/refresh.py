@@ -0,0 +1,206 @@
+import json
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from finance_cache.finance_cache import FinanceCache
+from finance_cache.public_models import LoadStats, TickerAccess
+from marshmallow import Schema, fields, post_load
+
+# Minimum time between two requests to Yahoo! Finance. Matches the default
+# rate limit of `YFinanceFetcher`.
+SECONDS_PER_REQUEST = 3
+
+
+@dataclass
+class TickerRefreshState:
+    """What the scheduler knows about refreshing a single ticker."""
+
+    ticker: str
+    # When the ticker was last refreshed successfully.
+    last_refreshed: Optional[datetime] = None
+    # Number of refreshes that failed since the last successful one.
+    consecutive_failures: int = 0
+    # The ticker is not attempted again before this time after a failure.
+    retry_after: Optional[datetime] = None
+
+
+class TickerRefreshStateSchema(Schema):
+    """Marshmallow schema used to persist a `TickerRefreshState`."""
+
+    ticker = fields.String(required=True)
+    last_refreshed = fields.DateTime(allow_none=True)
+    consecutive_failures = fields.Integer()
+    retry_after = fields.DateTime(allow_none=True)
+
+    @post_load
+    def make_state(self, data, **kwargs) -> TickerRefreshState:
+        return TickerRefreshState(**data)
+
+
+class RefreshStateSchema(Schema):
+    """Marshmallow schema of the file that the scheduler persists."""
+
+    tickers = fields.List(fields.Nested(TickerRefreshStateSchema))
+
+
+class RefreshScheduler:
+    """
+    Keeps a FinanceCache fresh by periodically re-loading its tickers.
+
+    Tickers that are read more often (see `FinanceCache.record_access()`) are
+    refreshed first, and tickers that keep failing to load are retried with
+    exponential backoff. The state is persisted to `state_path` after every
+    refresh so that it survives restarts.
+    """
+
+    def __init__(
+        self,
+        cache: FinanceCache,
+        state_path: Path,
+        max_age=timedelta(hours=12),
+        access_half_life=timedelta(days=7),
+        min_backoff=timedelta(minutes=5),
+        max_backoff=timedelta(days=1),
+    ):
+        """
+        max_age: A ticker is refreshed once its data is older than this.
+        access_half_life: How quickly old reads stop counting towards a
+          ticker's priority.
+        min_backoff: How long to wait before retrying a ticker that failed
+          once. Doubles with every consecutive failure up to `max_backoff`.
+        """
+        self._cache = cache
+        self._state_path = state_path
+        self._max_age = max_age
+        self._access_half_life = access_half_life
+        self._min_backoff = min_backoff
+        self._max_backoff = max_backoff
+        self._states: Dict[str, TickerRefreshState] = {}
+        if state_path.exists():
+            with open(state_path) as state_file:
+                loaded = RefreshStateSchema().load(json.load(state_file))
+            self._states = {s.ticker: s for s in loaded["tickers"]}
+
+    def _get_state(self, ticker: str) -> TickerRefreshState:
+        if ticker not in self._states:
+            self._states[ticker] = TickerRefreshState(ticker)
+        return self._states[ticker]
+
+    def _priority(self, access: Optional[TickerAccess], now: datetime) -> float:
+        """Returns the number of reads of a ticker, decayed by their age."""
+        if not access:
+            return 0
+        age = max(now - access.last_read, timedelta(0))
+        return access.num_reads * 0.5 ** (age / self._access_half_life)
+
+    def get_due_tickers(self, now: datetime) -> List[str]:
+        """
+        Returns the tickers that should be refreshed at `now`, highest
+        priority first.
+        """
+        accesses = self._cache.get_access_counts()
+        # Reads only affect the priority: tickers that were read but are not
+        # in the cache may not exist, and are never loaded.
+        tickers = set(t.upper() for t in self._cache.get_tickers())
+        due = []
+        for ticker in tickers:
+            state = self._get_state(ticker)
+            if state.retry_after and now < state.retry_after:
+                continue
+            if state.last_refreshed and now - state.last_refreshed < self._max_age:
+                continue
+            due.append(ticker)
+        # Hottest first. Ties go to the ticker that was refreshed longest ago.
+        return sorted(
+            due,
+            key=lambda t: (
+                -self._priority(accesses.get(t), now),
+                self._states[t].last_refreshed or datetime.min,
+                t,
+            ),
+        )
+
+    def _record_failure(self, ticker: str, error: Exception):
+        state = self._get_state(ticker)
+        state.consecutive_failures += 1
+        backoff = min(
+            self._min_backoff * 2 ** (state.consecutive_failures - 1),
+            self._max_backoff,
+        )
+        state.retry_after = datetime.now() + backoff
+        print(f"Failed to refresh {ticker}, retrying in {backoff}: {error}")
+
+    def refresh(self, tickers: List[str]) -> Optional[LoadStats]:
+        """
+        Loads `tickers` into the cache and records the outcome for each of
+        them. Returns the stats of the load, or None if it failed entirely.
+        """
+        try:
+            stats = self._cache.load_many(tickers)
+        except Exception as e:
+            for ticker in tickers:
+                self._record_failure(ticker, e)
+            self.save()
+            return None
+
+        for ticker in tickers:
+            if ticker in stats.failed:
+                self._record_failure(ticker, stats.failed[ticker])
+            else:
+                state = self._get_state(ticker)
+                state.last_refreshed = datetime.now()
+                state.consecutive_failures = 0
+                state.retry_after = None
+        self.save()
+        return stats
+
+    def refresh_due(self, max_requests: int) -> Optional[LoadStats]:
+        """
+        Refreshes as many of the tickers that are due as can be loaded with
+        at most `max_requests` requests, highest priority first. Returns the
+        stats of the load, or None if nothing was due or the load failed.
+
+        The estimate is deliberately pessimistic: every due ticker is charged
+        a request, although one that isn't missing any data takes none.
+        """
+        # Due tickers are all in the cache, so only their market data is
+        # fetched, with a single request each.
+        selected = self.get_due_tickers(datetime.now())[:max_requests]
+        if not selected:
+            return None
+        return self.refresh(selected)
+
+    def run(self, cycle=timedelta(minutes=5)):
+        """
+        Refreshes due tickers forever. Every `cycle`, attempts as many tickers
+        as can be loaded with the requests that the rate limit allows within
+        one cycle.
+        """
+        max_requests = max(int(cycle.total_seconds() // SECONDS_PER_REQUEST), 1)
+        while True:
+            start_time = datetime.now()
+            stats = self.refresh_due(max_requests)
+            if stats:
+                print(
+                    f"Refreshed {stats.num_tickers} tickers with "
+                    f"{stats.num_requests} requests, adding "
+                    f"{stats.num_days_added} days of data."
+                )
+            elapsed = datetime.now() - start_time
+            time.sleep(max((cycle - elapsed).total_seconds(), 0))
+
+    def save(self):
+        """Persists the state to `state_path`."""
+        tmp_path = self._state_path.with_suffix(".tmp")
+        with open(tmp_path, "w+") as out:
+            json.dump(
+                RefreshStateSchema().dump({"tickers": list(self._states.values())}),
+                out,
+                indent=4,
+            )
+        # Replace atomically so that a crash never leaves a partial file.
+        os.replace(tmp_path, self._state_path)
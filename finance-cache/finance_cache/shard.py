@@ -0,0 +1,37 @@
+import threading
+import zlib
+from pathlib import Path
+
+from finance_cache.models import Base
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+
+def get_shard_index(ticker: str, num_shards: int) -> int:
+    """
+    Returns the index of the shard that stores `ticker`. Uses a stable hash,
+    so that the result is the same across processes.
+    """
+    return zlib.crc32(ticker.upper().encode("utf-8")) % num_shards
+
+
+class Shard:
+    """One of the Sqlite databases that a FinanceCache is partitioned into."""
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self.engine = create_engine(f"sqlite:///{db_path.absolute()}")
+        # Adds any tables that are missing from caches created by an older
+        # version. Existing tables are left untouched.
+        Base.metadata.create_all(self.engine)
+        self.session_maker = sessionmaker(bind=self.engine)
+        # Sqlite only allows a single writer per database, and a transaction
+        # holds its lock from its first write until it commits. Hold this for
+        # the whole write transaction, and never make requests while holding
+        # it, so that threads of this process queue here rather than time out
+        # with "database is locked". Other processes rely on the busy timeout.
+        self.write_lock = threading.Lock()
+
+    def dispose(self):
+        """Closes all connections to the database."""
+        self.engine.dispose()
@@ -0,0 +1,60 @@
+import threading
+from typing import Callable, Dict, Hashable, Optional, TypeVar
+
+from finance_cache.public_models import CoalescingStats
+
+T = TypeVar("T")
+
+
+class _Call:
+    """A call that is in flight, and the callers waiting on it."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: while a call for a key is
+    in flight, other callers with that key wait for it and share its result
+    (or its exception) instead of making their own call.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._num_calls = 0
+        self._num_coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        """Returns the result of `fn()`, sharing it with concurrent callers."""
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+                self._num_calls += 1
+            else:
+                self._num_coalesced += 1
+        if not is_leader:
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self) -> CoalescingStats:
+        with self._lock:
+            return CoalescingStats(self._num_calls, self._num_coalesced)
@@ -7,9 +7,11 @@ from finance_cache.finance_cache import FinanceCache
 from flask import Flask, Response, make_response, request
 
 from portfolio_analyzer.analyze import (calculate_value_over_time,
-                                        preprocess_portfolio)
+                                        preprocess_portfolio_json)
 from portfolio_analyzer.config import AppConfig
-from portfolio_analyzer.portfolio import PortfolioSchema
+from portfolio_analyzer.simulation import (MAX_PATHS, MAX_YEARS,
+                                           TRADING_DAYS_PER_YEAR,
+                                           simulate_value_over_time)
 
 
 def create_app(app_config: AppConfig = None):
@@ -27,6 +29,7 @@ def create_app(app_config: AppConfig = None):
     @app.route("/ticker/<string:ticker>")
     def get_ticker(ticker: str):
         # TODO: implement a better mechanism to pre-load the cache.
+        app.config["FINANCE_CACHE"].record_access([ticker])
         history = app.config["FINANCE_CACHE"].get_price_history(
             ticker,
             datetime(year=2022, month=1, day=1).date(),
@@ -54,8 +57,8 @@ def create_app(app_config: AppConfig = None):
             start_date = datetime.fromisoformat(request.args["start_date"]).date()
             end_date = datetime.fromisoformat(request.args["end_date"]).date()
             as_json = json.loads(request.data.decode("ascii"))
-            raw_portfolio = PortfolioSchema().load(as_json)
-            processed_portfolio = preprocess_portfolio(raw_portfolio)
+            processed_portfolio = preprocess_portfolio_json(as_json)
+            app.config["FINANCE_CACHE"].record_access(processed_portfolio.tickers)
             res = calculate_value_over_time(
                 processed_portfolio,
                 start_date,
@@ -71,4 +74,50 @@ def create_app(app_config: AppConfig = None):
             print(e)
             return Response(status=500)
 
+    @app.route("/simulate", methods=["OPTIONS"])
+    def simulate_portfolio_cors():
+        res = make_response()
+        res.headers.add("Access-Control-Allow-Origin", "*")
+        res.headers.add("Access-Control-Allow-Headers", "*")
+        return res
+
+    @app.route("/simulate", methods=["POST"])
+    def simulate_portfolio():
+        try:
+            # TODO: marshmallow validation of query params.
+            history_start = datetime.fromisoformat(request.args["history_start"]).date()
+            history_end = datetime.fromisoformat(request.args["history_end"]).date()
+            num_years = min(
+                max(float(request.args.get("years", 10)), 1 / TRADING_DAYS_PER_YEAR),
+                MAX_YEARS,
+            )
+            num_paths = min(max(int(request.args.get("paths", 10000)), 1), MAX_PATHS)
+            seed = int(request.args["seed"]) if "seed" in request.args else None
+            as_json = json.loads(request.data.decode("ascii"))
+            processed_portfolio = preprocess_portfolio_json(as_json)
+            app.config["FINANCE_CACHE"].record_access(processed_portfolio.tickers)
+            res = simulate_value_over_time(
+                processed_portfolio,
+                history_start,
+                history_end,
+                app.config["FINANCE_CACHE"],
+                num_years=num_years,
+                num_paths=num_paths,
+                seed=seed,
+            )
+            as_json = [
+                {
+                    "date": str(r.date),
+                    "percentiles": {str(p): v for p, v in r.values.items()},
+                }
+                for r in res
+            ]
+            response = make_response(as_json)
+            # TODO: remove
+            response.headers.add("Access-Control-Allow-Origin", "*")
+            return response
+        except Exception as e:
+            print(e)
+            return Response(status=500)
+
     return app
@@ -1,12 +1,19 @@
 import datetime
-from collections import defaultdict
 from dataclasses import dataclass
-from typing import Dict, List, Set
+from typing import Any, Dict, List, Set
 
+import numpy as np
 from finance_cache.finance_cache import FinanceCache
-from finance_cache.public_models import PriceHistory
 
-from portfolio_analyzer.portfolio import Action, ActionType, Portfolio
+from portfolio_analyzer.portfolio import (ActionColumns, Portfolio,
+                                          load_action_columns)
+
+# The oldest close price that is used to value a ticker on a day that it has
+# no data for, e.g. because its exchange was closed.
+MAX_PRICE_STALENESS = datetime.timedelta(days=7)
+
+# Ordinal of the day that `datetime64[D]` values count from.
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
 
 
 # TODO: make immutable.
@@ -14,15 +21,27 @@ from portfolio_analyzer.portfolio import Action, ActionType, Portfolio
 class ProcessedPortfolio:
     starting_cash: float
     tickers: Set[str]
-    actions: List[Action]
+    # Sorted by day.
+    actions: ActionColumns
 
 
 def preprocess_portfolio(portfolio: Portfolio) -> ProcessedPortfolio:
     # TODO: check that each ticker is present in the cache?
+    actions = ActionColumns.from_actions(portfolio.actions)
+    return ProcessedPortfolio(
+        portfolio.starting_cash, set(actions.tickers), actions.sorted_by_day()
+    )
+
+
+def preprocess_portfolio_json(as_json: Any) -> ProcessedPortfolio:
+    """
+    Loads and preprocesses a portfolio in the format of `PortfolioSchema`.
+    Faster than `preprocess_portfolio(PortfolioSchema().load(as_json))`, and
+    raises the same errors.
+    """
+    starting_cash, actions = load_action_columns(as_json)
     return ProcessedPortfolio(
-        portfolio.starting_cash,
-        set([action.ticker for action in portfolio.actions]),
-        sorted(portfolio.actions, key=lambda a: a.date),
+        starting_cash, set(actions.tickers), actions.sorted_by_day()
     )
 
 
@@ -32,27 +51,6 @@ class DateAndValue:
     value: float
 
 
-def calculate_value_at_close(
-    curr_holdings: Dict[str, float],
-    date: datetime.date,
-    price_history: Dict[str, Dict[datetime.date, PriceHistory]],
-) -> float:
-    """
-    Returns the value of `curr_holdings` at the close of `date`.
-
-    Raises ValueError if `price_history` does not have a value for
-    every ticker on `date`.
-    """
-    curr_value = 0
-    for ticker, volume in curr_holdings.items():
-        if ticker not in price_history:
-            raise ValueError(f"No data for {ticker}.")
-        if date not in price_history[ticker]:
-            raise ValueError(f"No data for {ticker} on {date}.")
-        curr_value += volume * price_history[ticker][date].close
-    return curr_value
-
-
 def calculate_value_over_time(
     portfolio: ProcessedPortfolio,
     start_date: datetime.date,
@@ -63,7 +61,9 @@ def calculate_value_over_time(
     Calculates the value of the portfolio at every trading day between
     `start_date` and `end_date`, inclusive.
 
-    Drops dates for which it does not have a stock price for every ticker.
+    A ticker that has no data on a trading day is valued at its most recent
+    close, if that is at most `MAX_PRICE_STALENESS` old. Drops dates for which
+    that is not possible for every ticker held.
     """
     # Silently correct the easy-to-make error of passing in a datetime.
     if isinstance(start_date, datetime.datetime):
@@ -71,53 +71,54 @@ def calculate_value_over_time(
     if isinstance(end_date, datetime.datetime):
         end_date = end_date.date()
 
-    # Prefetch the values of each ticker for the desired date range.
-    price_history: Dict[str, Dict[datetime.date, PriceHistory]] = {}
+    # Prefetch the values of each ticker for the desired date range, plus
+    # enough history to value the first days.
     for ticker in portfolio.tickers:
         if not finance_cache.knows_ticker(ticker):
             raise ValueError(f"finance_cache does not have data for {ticker}")
-        price_history[ticker] = finance_cache.get_price_history(
-            ticker, start_date, end_date
-        )
+    price_series = finance_cache.get_price_series(
+        portfolio.tickers, start_date - MAX_PRICE_STALENESS, end_date
+    )
+
+    # Trading days are the days on which any of the tickers has data.
+    all_days = [series.days for series in price_series.values()]
+    trading_days = (
+        np.unique(np.concatenate(all_days)) if all_days else np.zeros(0, np.int64)
+    )
+    trading_days = trading_days[
+        (trading_days >= start_date.toordinal())
+        & (trading_days <= end_date.toordinal())
+    ]
+    # Look up the as-of close of every ticker on every trading day at once.
+    closes: Dict[str, np.ndarray] = {}
+    for ticker, series in price_series.items():
+        positions = series.positions_on_or_before(trading_days)
+        ticker_closes = series.close[positions]
+        is_stale = trading_days - series.days[positions] > MAX_PRICE_STALENESS.days
+        ticker_closes[(positions < 0) | is_stale] = np.nan
+        closes[ticker] = ticker_closes
+
+    actions = portfolio.actions
+    # Number of actions applied by the end of each trading day.
+    action_days = actions.days.astype(np.int64) + EPOCH_ORDINAL
+    num_applied = np.searchsorted(action_days, trading_days, side="right")
 
-    value_over_time: List[DateAndValue] = []
-    # Track current stock holdings: {ticker -> volume}.
-    curr_holdings: Dict[str, float] = defaultdict(lambda: 0)
     # The cash balance from buying/selling shares. May go below zero.
-    cash = portfolio.starting_cash
-    # Index of next action to be applied.
-    next_index = 0
-    # Date being processed.
-    curr_date = start_date
-
-    while curr_date <= end_date:
-        # Apply any actions from this day.
-        while (
-            next_index < len(portfolio.actions)
-            and portfolio.actions[next_index].date == curr_date
-        ):
-            action = portfolio.actions[next_index]
-            print(f"Processing action {action} on {curr_date}.")
-            if action.type == ActionType.Buy:
-                curr_holdings[action.ticker] += action.volume
-                cash -= action.volume * action.price
-            elif action.type == ActionType.Sell:
-                curr_holdings[action.ticker] -= action.volume
-                cash += action.volume * action.price
-            else:
-                raise NotImplementedError()
-            next_index += 1
-
-        try:
-            curr_value = cash + calculate_value_at_close(
-                curr_holdings, curr_date, price_history
-            )
-            value_over_time.append(DateAndValue(curr_date, curr_value))
-        except ValueError:
-            # print(f"Skipping {curr_date} because we don't have data for every ticker.")
-            pass
-
-        # Increment to the next day
-        curr_date = curr_date + datetime.timedelta(days=1)
-
-    return value_over_time
+    signed_volumes = actions.signed_volumes()
+    cash_flows = np.concatenate([[0], np.cumsum(signed_volumes * actions.prices)])
+    values = portfolio.starting_cash - cash_flows[num_applied]
+    is_valued = np.ones(len(trading_days), dtype=bool)
+    for code, ticker in enumerate(actions.tickers):
+        # The volume held at the end of each trading day.
+        ticker_actions = np.flatnonzero(actions.ticker_codes == code)
+        volumes = np.concatenate([[0], np.cumsum(signed_volumes[ticker_actions])])
+        held = volumes[np.searchsorted(ticker_actions, num_applied)]
+        is_held = held != 0
+        # Drop days on which a held ticker has no recent close.
+        is_valued &= ~(is_held & np.isnan(closes[ticker]))
+        values += np.where(is_held, held * closes[ticker], 0)
+
+    return [
+        DateAndValue(datetime.date.fromordinal(int(day)), float(value))
+        for day, value in zip(trading_days[is_valued], values[is_valued])
+    ]
@@ -0,0 +1,285 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import date, timedelta
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from finance_cache.finance_cache import FinanceCache
+
+from portfolio_analyzer.analyze import MAX_PRICE_STALENESS
+from portfolio_analyzer.dollar_cost_averaging import (
+    DcaBuy, DollarCostAverageStrategy, get_closest_following_weekday)
+
+
+@dataclass(frozen=True)
+class SweepResult:
+    """Backtest summary of a single strategy evaluated by a sweep."""
+
+    strategy: DollarCostAverageStrategy
+    # Total USD spent on purchases.
+    total_invested: float
+    # Value of the holdings plus unspent cash at the last day with data.
+    final_value: float
+    # `final_value` relative to `total_invested`, e.g. 0.1 for a 10% gain.
+    total_return: float
+    # Largest peak-to-trough decline of the value, e.g. 0.2 for a 20% drop.
+    max_drawdown: float
+    # Number of purchases that were executed.
+    num_buys: int
+
+
+@dataclass
+class PriceMatrix:
+    """
+    Open/close prices of several tickers on a shared axis of days.
+
+    `days` holds the date ordinals of every day on which at least one ticker
+    has data, sorted increasing. `open` and `close` have one row per day and
+    one column per ticker, and are NaN where a ticker has no data on a day.
+    """
+
+    tickers: List[str]
+    days: np.ndarray
+    open: np.ndarray
+    close: np.ndarray
+
+    @staticmethod
+    def load(
+        tickers: Iterable[str],
+        start_date: date,
+        end_date: date,
+        finance_cache: FinanceCache,
+    ) -> "PriceMatrix":
+        """Reads the price history of every ticker from the cache once."""
+        tickers = sorted(set(tickers))
+        histories = {}
+        for ticker in tickers:
+            if not finance_cache.knows_ticker(ticker):
+                raise ValueError(f"finance_cache does not have data for {ticker}")
+            histories[ticker] = finance_cache.get_price_history(
+                ticker, start_date, end_date
+            )
+
+        all_days = sorted(set(day for h in histories.values() for day in h))
+        days = np.array([d.toordinal() for d in all_days], dtype=np.int64)
+        row_of = {day: row for row, day in enumerate(all_days)}
+        open_prices = np.full((len(days), len(tickers)), np.nan)
+        close_prices = np.full((len(days), len(tickers)), np.nan)
+        for col, ticker in enumerate(tickers):
+            for day, price in histories[ticker].items():
+                open_prices[row_of[day], col] = price.open
+                close_prices[row_of[day], col] = price.close
+        return PriceMatrix(tickers, days, open_prices, close_prices)
+
+
+def strategy_grid(
+    frequencies: Iterable[str],
+    weekdays: Iterable[int],
+    mixes: Iterable[Dict[str, float]],
+) -> List[DollarCostAverageStrategy]:
+    """
+    Returns the cartesian product of the given options as strategies.
+
+    Each entry of `mixes` maps ticker -> USD amount bought on every scheduled
+    day, which covers both the ticker mix and the split of the amount.
+    """
+    return [
+        DollarCostAverageStrategy(
+            frequency,
+            [DcaBuy(ticker, amount) for ticker, amount in mix.items()],
+            weekday,
+        )
+        for frequency, weekday, mix in itertools.product(
+            frequencies, weekdays, list(mixes)
+        )
+    ]
+
+
+def _as_of_closes(days: np.ndarray, close_prices: np.ndarray) -> np.ndarray:
+    """
+    Fills the days that a ticker has no close for with its most recent close,
+    as long as that is at most `MAX_PRICE_STALENESS` old.
+    """
+    filled = np.full_like(close_prices, np.nan)
+    for col in range(close_prices.shape[1]):
+        rows_with_data = np.flatnonzero(~np.isnan(close_prices[:, col]))
+        if len(rows_with_data) == 0:
+            continue
+        positions = np.searchsorted(days[rows_with_data], days, side="right") - 1
+        rows = rows_with_data[positions]
+        is_recent = (positions >= 0) & (days - days[rows] <= MAX_PRICE_STALENESS.days)
+        filled[is_recent, col] = close_prices[rows[is_recent], col]
+    return filled
+
+
+def evaluate_strategies(
+    strategies: List[DollarCostAverageStrategy],
+    start_date: date,
+    end_date: date,
+    prices: PriceMatrix,
+) -> List[SweepResult]:
+    """
+    Backtests `strategies` from `start_date` (inclusive) until `end_date`
+    (exclusive), with the same semantics as `generate_portfolio` followed by
+    `calculate_value_over_time`.
+
+    Strategies that share a schedule are evaluated together: the value of a
+    DCA portfolio is linear in the amount bought per ticker, so the value of
+    the whole group over time is a single matrix product.
+    """
+    results: List[Optional[SweepResult]] = [None] * len(strategies)
+    groups: Dict[Tuple[timedelta, int], List[int]] = {}
+    for i, strategy in enumerate(strategies):
+        groups.setdefault((strategy.interval(), strategy.weekday), []).append(i)
+
+    in_range = (prices.days >= start_date.toordinal()) & (
+        prices.days < end_date.toordinal()
+    )
+    days = prices.days[in_range]
+    open_prices = prices.open[in_range]
+    close_prices = _as_of_closes(days, prices.close[in_range])
+    col_of = {ticker: col for col, ticker in enumerate(prices.tickers)}
+
+    for (interval, weekday), members in groups.items():
+        # Per ticker, the number of buys and the shares bought per USD that
+        # were executed up to and including each day. A scheduled buy is made
+        # on the first day on or after the scheduled day that has data, unless
+        # that is `max_delay` or more later.
+        first = get_closest_following_weekday(start_date, weekday).toordinal()
+        schedule = np.arange(first, end_date.toordinal(), interval.days)
+        max_delay = strategies[members[0]].max_delay().days
+        bought = np.zeros_like(open_prices)
+        shares_per_usd = np.zeros_like(open_prices)
+        for col in range(len(prices.tickers)):
+            rows_with_data = np.flatnonzero(~np.isnan(open_prices[:, col]))
+            positions = np.searchsorted(days[rows_with_data], schedule)
+            found = positions < len(rows_with_data)
+            rows = rows_with_data[positions[found]]
+            rows = rows[days[rows] - schedule[found] < max_delay]
+            np.add.at(bought[:, col], rows, 1)
+            np.add.at(shares_per_usd[:, col], rows, 1 / open_prices[rows, col])
+        buys_so_far = np.cumsum(bought, axis=0)
+        held_per_usd = np.cumsum(shares_per_usd, axis=0)
+        total_buys = buys_so_far[-1] if len(days) else np.zeros(len(prices.tickers))
+
+        # USD amount bought per scheduled day: one row per strategy.
+        amounts = np.zeros((len(members), len(prices.tickers)))
+        for k, i in enumerate(members):
+            for order in strategies[i].orders:
+                amounts[k, col_of[order.ticker]] += order.amount_usd
+
+        invested = amounts @ total_buys
+        # Value = unspent cash + value of holdings at close.
+        per_usd_value = np.nan_to_num(held_per_usd * close_prices) - buys_so_far
+        values = invested[:, None] + amounts @ per_usd_value.T
+        # A day is only valued if every ticker held so far has a recent close.
+        missing = np.isnan(close_prices) & (buys_so_far > 0)
+        valid = ((amounts > 0) @ missing.T) == 0
+        values[~valid] = np.nan
+
+        peaks = np.fmax.accumulate(values, axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            drawdowns = 1 - values / peaks
+        has_value = valid.any(axis=1)
+        last = valid.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+        num_buys = (amounts > 0) @ total_buys
+
+        for k, i in enumerate(members):
+            final_value = values[k, last[k]] if has_value[k] else np.nan
+            results[i] = SweepResult(
+                strategy=strategies[i],
+                total_invested=float(invested[k]),
+                final_value=float(final_value),
+                total_return=float(final_value / invested[k] - 1)
+                if invested[k] > 0
+                else 0.0,
+                max_drawdown=float(np.nanmax(drawdowns[k])) if has_value[k] else 0.0,
+                num_buys=int(num_buys[k]),
+            )
+    return results
+
+
+# Price data attached by each worker process of the pool.
+_worker_shm: List[SharedMemory] = []
+_worker_prices: Optional[PriceMatrix] = None
+
+
+def _share(array: np.ndarray) -> SharedMemory:
+    """Copies `array` into a new shared memory block."""
+    shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+    return shm
+
+
+def _init_worker(tickers: List[str], num_days: int, shm_names: List[str]):
+    """Attaches the worker to the price arrays shared by the parent process."""
+    global _worker_prices
+    _worker_shm[:] = [SharedMemory(name=name) for name in shm_names]
+    days_shm, open_shm, close_shm = _worker_shm
+    shape = (num_days, len(tickers))
+    _worker_prices = PriceMatrix(
+        tickers,
+        np.ndarray((num_days,), dtype=np.int64, buffer=days_shm.buf),
+        np.ndarray(shape, dtype=np.float64, buffer=open_shm.buf),
+        np.ndarray(shape, dtype=np.float64, buffer=close_shm.buf),
+    )
+
+
+def _evaluate_chunk(
+    strategies: List[DollarCostAverageStrategy], start_date: date, end_date: date
+) -> List[SweepResult]:
+    return evaluate_strategies(strategies, start_date, end_date, _worker_prices)
+
+
+def sweep_strategies(
+    strategies: List[DollarCostAverageStrategy],
+    start_date: date,
+    end_date: date,
+    finance_cache: FinanceCache,
+    processes: Optional[int] = None,
+    chunk_size: int = 256,
+) -> List[SweepResult]:
+    """
+    Backtests every strategy from `start_date` (inclusive) until `end_date`
+    (exclusive) and returns the results ranked by `total_return`, best first.
+
+    Prices are read from the cache once and shared with a pool of `processes`
+    workers (defaults to the number of CPUs) that each evaluate `chunk_size`
+    strategies at a time.
+    """
+    tickers = set(t for strategy in strategies for t in strategy.tickers())
+    prices = PriceMatrix.load(tickers, start_date, end_date, finance_cache)
+
+    # Keep strategies with the same schedule in the same chunk.
+    ordered = sorted(strategies, key=lambda s: (s.interval(), s.weekday))
+    chunks = [ordered[i : i + chunk_size] for i in range(0, len(ordered), chunk_size)]
+    processes = min(processes or os.cpu_count() or 1, len(chunks))
+
+    if processes <= 1:
+        results = evaluate_strategies(ordered, start_date, end_date, prices)
+    else:
+        shared = [_share(prices.days), _share(prices.open), _share(prices.close)]
+        try:
+            with ProcessPoolExecutor(
+                max_workers=processes,
+                initializer=_init_worker,
+                initargs=(prices.tickers, len(prices.days), [s.name for s in shared]),
+            ) as executor:
+                futures = [
+                    executor.submit(_evaluate_chunk, chunk, start_date, end_date)
+                    for chunk in chunks
+                ]
+                results = [r for future in futures for r in future.result()]
+        finally:
+            for shm in shared:
+                shm.close()
+                shm.unlink()
+
+    # NaN final values (no data at all) are ranked last.
+    return sorted(
+        results,
+        key=lambda r: (np.isnan(r.total_return), -np.nan_to_num(r.total_return)),
+    )
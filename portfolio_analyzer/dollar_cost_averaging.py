@@ -4,8 +4,18 @@ from datetime import date, datetime, timedelta
 from pathlib import Path
 from typing import Dict, List, Set
 
-from finance_cache.finance_cache import FinanceCache, PriceHistory
-from portfolio import Action, ActionType, Portfolio, PortfolioSchema
+from finance_cache.finance_cache import FinanceCache
+
+from portfolio_analyzer.analyze import MAX_PRICE_STALENESS
+from portfolio_analyzer.portfolio import (Action, ActionType, Portfolio,
+                                          PortfolioSchema)
+
+# Number of weeks between purchases for each supported `frequency`.
+FREQUENCY_WEEKS: Dict[str, int] = {
+    "weekly": 1,
+    "biweekly": 2,
+    "every-4-weeks": 4,
+}
 
 
 @dataclass
@@ -25,23 +35,45 @@ class DollarCostAverageStrategy:
 
     # TODO: need a more general-purpose way of representing time periods, e.g.
     # "Every week on Monday", "Every 3 weeks on Tuesday", "On the 15th of each month".
+    # One of the keys of `FREQUENCY_WEEKS`.
     frequency: str
     orders: List[DcaBuy]
+    # The day of the week on which to buy. Monday = 0, Sunday = 6.
+    weekday: int = 0
 
     def tickers(self) -> Set[str]:
         return set([buy.ticker for buy in self.orders])
 
+    def interval(self) -> timedelta:
+        """Returns the time between two scheduled purchases."""
+        if self.frequency not in FREQUENCY_WEEKS:
+            raise ValueError(f"Unsupported frequency: {self.frequency}.")
+        return timedelta(weeks=FREQUENCY_WEEKS[self.frequency])
+
+    def max_delay(self) -> timedelta:
+        """
+        Returns how long after a scheduled day a purchase may still be made if
+        there is no data for the scheduled day itself. A purchase is never
+        delayed to or past the next scheduled day.
+        """
+        return min(self.interval(), MAX_PRICE_STALENESS)
+
+
+def get_closest_following_weekday(day: date, weekday: int) -> date:
+    """
+    Returns the day closest to `day` that falls on `weekday` and comes on or
+    after `day`. I.e., if `day` is itself on `weekday`, it is returned as-is.
+    """
+    return day + timedelta(days=(weekday - day.weekday()) % 7)
+
 
 def get_closest_following_monday(day: date) -> date:
     """
     Returns the Monday closest to `day` that comes on or after `day`.
     I.e., if `day` is itself a Monday, it will simply be returned as-is.
     """
-    weekday = day.weekday()
     # Monday = 0
-    if weekday == 0:
-        return day
-    return day + timedelta(days=7 - weekday)
+    return get_closest_following_weekday(day, 0)
 
 
 def generate_portfolio(
@@ -54,43 +86,50 @@ def generate_portfolio(
     Procedurally generates transactions based on the given strategy, running
     from `start_date` (inclusive) until `end_date` (exclusive).
     """
-    # Note: for now we ignore `frequency` and always buy once a week on Monday.
-    # If we don't have ticker data for that day, we try the following day.
-    # If that also fails then we fail the overall attempt.
+    # If we don't have ticker data for a scheduled day, the purchase is made on
+    # the next day that we do have data for, unless that is `max_delay()` or
+    # more later. Then the purchase is skipped.
     cash_needed = 0
     actions: List[Action] = []
-    curr_date = get_closest_following_monday(start_date)
-    # TODO: get all needed tickers and pre-load them from the cache.
+    first_date = get_closest_following_weekday(start_date, strategy.weekday)
+    schedule = range(
+        first_date.toordinal(), end_date.toordinal(), strategy.interval().days
+    )
+    max_delay = strategy.max_delay()
     # Prefetch the values of each ticker for the desired date range.
-    price_history: Dict[str, Dict[date, PriceHistory]] = {}
     for ticker in strategy.tickers():
         if not finance_cache.knows_ticker(ticker):
             raise ValueError(f"finance_cache does not have data for {ticker}")
-        price_history[ticker] = finance_cache.get_price_history(
-            ticker, start_date, end_date
-        )
-
-    while curr_date < end_date:
-        # For each scheduled buy, use the open price to create the action with
-        # the proper price and number of shares.
-        for order in strategy.orders:
-            try:
-                open_price = price_history[order.ticker][curr_date].open
-                actions.append(
-                    Action(
-                        ActionType.Buy,
-                        order.ticker,
-                        curr_date,
-                        order.amount_usd / open_price,
-                        open_price,
-                    )
+    price_series = finance_cache.get_price_series(
+        strategy.tickers(), start_date, end_date
+    )
+
+    # For each scheduled buy, use the open price to create the action with the
+    # proper price and number of shares.
+    for order in strategy.orders:
+        series = price_series[order.ticker]
+        positions = series.positions_on_or_after(schedule)
+        for scheduled, position in zip(schedule, positions):
+            if position < 0:
+                break
+            price = series.at(position)
+            if price.day >= end_date:
+                break
+            if price.day - date.fromordinal(scheduled) >= max_delay:
+                continue
+            actions.append(
+                Action(
+                    ActionType.Buy,
+                    order.ticker,
+                    price.day,
+                    order.amount_usd / price.open,
+                    price.open,
                 )
-                cash_needed += order.amount_usd
-            except KeyError as e:
-                # TODO: find the next available day.
-                print(f"Skipping {curr_date}.")
-        curr_date += timedelta(weeks=1)
+            )
+            cash_needed += order.amount_usd
 
+    # Sorting is stable, so same-day orders keep the strategy's order.
+    actions.sort(key=lambda a: a.date)
     return Portfolio(cash_needed, actions)
 
 
@@ -1,8 +1,10 @@
+import math
 from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
-from typing import List, Optional
+from typing import Any, List, Optional, Tuple
 
+import numpy as np
 from marshmallow import Schema, fields, post_load, validate
 from marshmallow_enum import EnumField
 
@@ -54,3 +56,151 @@ class PortfolioSchema(Schema):
     @post_load
     def to_dataclass(self, data, **kwargs) -> Portfolio:
         return Portfolio(data["starting_cash"], [Action(**a) for a in data["actions"]])
+
+
+@dataclass(frozen=True)
+class ActionColumns:
+    """
+    A compact representation of a list of actions, with one array per field
+    and one entry per action.
+    """
+
+    # The distinct tickers, sorted.
+    tickers: List[str]
+    # Ticker of each action, as an index into `tickers`.
+    ticker_codes: np.ndarray
+    # Date of each action, as days since the epoch (datetime64[D]).
+    days: np.ndarray
+    # True for a buy, False for a sell.
+    is_buy: np.ndarray
+    volumes: np.ndarray
+    # NaN where the action has no price.
+    prices: np.ndarray
+
+    @staticmethod
+    def from_actions(actions: List[Action]) -> "ActionColumns":
+        tickers, ticker_codes = np.unique(
+            np.array([a.ticker for a in actions], dtype=str), return_inverse=True
+        )
+        return ActionColumns(
+            tickers=tickers.tolist(),
+            ticker_codes=ticker_codes,
+            days=np.array([a.date for a in actions], dtype="datetime64[D]"),
+            is_buy=np.array([a.type == ActionType.Buy for a in actions], dtype=bool),
+            volumes=np.array([a.volume for a in actions], dtype=np.float64),
+            prices=np.array([a.price for a in actions], dtype=np.float64),
+        )
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def signed_volumes(self) -> np.ndarray:
+        """Returns the volume of each action, negative for sells."""
+        return np.where(self.is_buy, self.volumes, -self.volumes)
+
+    def sorted_by_day(self) -> "ActionColumns":
+        """
+        Returns the actions sorted by day, keeping the order of actions on the
+        same day. Returns `self` if they are already sorted.
+        """
+        if np.all(self.days[1:] >= self.days[:-1]):
+            return self
+        order = np.argsort(self.days, kind="stable")
+        return ActionColumns(
+            tickers=self.tickers,
+            ticker_codes=self.ticker_codes[order],
+            days=self.days[order],
+            is_buy=self.is_buy[order],
+            volumes=self.volumes[order],
+            prices=self.prices[order],
+        )
+
+
+_ACTION_KEYS = {"type", "ticker", "date", "volume", "price"}
+_PORTFOLIO_KEYS = {"starting_cash", "actions"}
+_MIN_DAY = np.datetime64("0001-01-01", "D")
+_MAX_DAY = np.datetime64("9999-12-31", "D")
+
+
+def _load_canonical(as_json: Any) -> Optional[Tuple[float, ActionColumns]]:
+    """
+    Loads a portfolio in canonical form: exactly the expected keys, JSON
+    numbers and "YYYY-MM-DD" dates. Returns None for anything else, which may
+    or may not be valid.
+    """
+    if type(as_json) is not dict or as_json.keys() != _PORTFOLIO_KEYS:
+        return None
+    starting_cash = as_json["starting_cash"]
+    actions = as_json["actions"]
+    if type(starting_cash) not in (int, float) or not math.isfinite(starting_cash):
+        return None
+    if starting_cash < 0:
+        return None
+    if type(actions) is not list:
+        return None
+
+    types, tickers, dates, volumes, prices = [], [], [], [], []
+    for action in actions:
+        if type(action) is not dict or action.keys() != _ACTION_KEYS:
+            return None
+        types.append(action["type"])
+        tickers.append(action["ticker"])
+        dates.append(action["date"])
+        volumes.append(action["volume"])
+        prices.append(action["price"])
+
+    if not {type(v) for v in types + tickers + dates} <= {str}:
+        return None
+    if not set(types) <= {ActionType.Buy.name, ActionType.Sell.name}:
+        return None
+    # `bool` is a subclass of `int`, but is not accepted by `fields.Float`.
+    if not {type(v) for v in volumes + prices} <= {int, float}:
+        return None
+    volumes = np.array(volumes, dtype=np.float64)
+    prices = np.array(prices, dtype=np.float64)
+    if not (np.all(np.isfinite(volumes)) and np.all(np.isfinite(prices))):
+        return None
+
+    dates = np.array(dates, dtype=str)
+    try:
+        days = dates.astype("datetime64[D]")
+    except ValueError:
+        return None
+    # Anything that doesn't round-trip, e.g. "2020-01", is not canonical.
+    if np.any(np.isnat(days)) or np.any(np.datetime_as_string(days) != dates):
+        return None
+    # `%Y` only accepts years 1 to 9999.
+    if np.any(days < _MIN_DAY) or np.any(days > _MAX_DAY):
+        return None
+
+    unique_tickers, ticker_codes = np.unique(
+        np.array(tickers, dtype=str), return_inverse=True
+    )
+    return float(starting_cash), ActionColumns(
+        tickers=unique_tickers.tolist(),
+        ticker_codes=ticker_codes,
+        days=days,
+        is_buy=np.array(types, dtype=str) == ActionType.Buy.name,
+        volumes=volumes,
+        prices=prices,
+    )
+
+
+def load_action_columns(as_json: Any) -> Tuple[float, ActionColumns]:
+    """
+    Loads a portfolio into its starting cash and its actions as columns.
+    Equivalent to, but much faster than, loading it with `PortfolioSchema`
+    for large portfolios.
+
+    Raises the same errors as `PortfolioSchema().load()` for invalid input.
+    """
+    try:
+        loaded = _load_canonical(as_json)
+    except OverflowError:
+        # An integer too large for a float.
+        loaded = None
+    if loaded is not None:
+        return loaded
+    # Let marshmallow deal with anything unusual, including reporting errors.
+    portfolio = PortfolioSchema().load(as_json)
+    return portfolio.starting_cash, ActionColumns.from_actions(portfolio.actions)
@@ -0,0 +1,195 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from finance_cache.finance_cache import FinanceCache
+
+from portfolio_analyzer.analyze import ProcessedPortfolio
+from portfolio_analyzer.dca_sweep import PriceMatrix
+
+# Number of trading days in a year, used to convert a horizon to steps.
+TRADING_DAYS_PER_YEAR = 252
+# Limits on the simulated horizon and the number of simulated paths.
+MAX_YEARS = 50
+MAX_PATHS = 100000
+# Upper bound on the number of simulated days (paths * days) that a worker
+# holds in memory at once.
+MAX_VALUES_PER_CHUNK = 2000000
+
+
+@dataclass
+class DateAndPercentiles:
+    date: date
+    # Percentile -> simulated portfolio value at that percentile.
+    values: Dict[float, float]
+
+
+@dataclass(frozen=True)
+class _SimulationInputs:
+    """Everything a worker needs to simulate a chunk of paths."""
+
+    # Daily log returns of every ticker: one row per day, one column per ticker.
+    log_returns: np.ndarray
+    # Value of the holdings of each ticker at the start of the simulation.
+    start_values: np.ndarray
+    cash: float
+    num_days: int
+    block_size: int
+    # Indices of the simulated days whose values are kept.
+    sample_days: np.ndarray
+
+
+def _simulate_chunk(
+    inputs: _SimulationInputs, entropy: int, first_path: int, num_paths: int
+) -> np.ndarray:
+    """
+    Simulates the `num_paths` block-bootstrapped paths starting at index
+    `first_path` and returns their values on the sample days: one row per
+    path, one column per sample day.
+    """
+    num_blocks = -(-inputs.num_days // inputs.block_size)
+    # Each path is a concatenation of randomly chosen blocks of consecutive
+    # historical days, so that short-term autocorrelation is preserved. All
+    # tickers use the same days, which preserves their correlation.
+    # Every path draws from its own stream, equivalent to
+    # `SeedSequence(entropy).spawn(num_total_paths)[path]`, so that paths
+    # don't depend on how they are split into chunks.
+    starts = np.stack(
+        [
+            np.random.default_rng(
+                np.random.SeedSequence(entropy, spawn_key=(path,))
+            ).integers(0, len(inputs.log_returns) - inputs.block_size + 1, num_blocks)
+            for path in range(first_path, first_path + num_paths)
+        ]
+    )
+    days = (starts[:, :, None] + np.arange(inputs.block_size)).reshape(num_paths, -1)
+    days = days[:, : inputs.num_days]
+
+    values = np.full((num_paths, len(inputs.sample_days)), float(inputs.cash))
+    # Go ticker-by-ticker so memory is bounded by `num_paths * num_days`.
+    for col, start_value in enumerate(inputs.start_values):
+        if start_value == 0:
+            continue
+        growth = np.exp(np.cumsum(inputs.log_returns[days, col], axis=1))
+        values += start_value * growth[:, inputs.sample_days]
+    return values
+
+
+def get_holdings(portfolio: ProcessedPortfolio) -> Dict[str, float]:
+    """Returns {ticker -> volume} held after applying all of the actions."""
+    actions = portfolio.actions
+    volumes = np.bincount(
+        actions.ticker_codes,
+        weights=actions.signed_volumes(),
+        minlength=len(actions.tickers),
+    )
+    return dict(zip(actions.tickers, volumes.tolist()))
+
+
+def get_cash(portfolio: ProcessedPortfolio) -> float:
+    """Returns the cash balance after applying all of the actions."""
+    actions = portfolio.actions
+    return portfolio.starting_cash - float(
+        np.sum(actions.signed_volumes() * actions.prices)
+    )
+
+
+def simulate_value_over_time(
+    portfolio: ProcessedPortfolio,
+    history_start: date,
+    history_end: date,
+    finance_cache: FinanceCache,
+    num_years: float = 10,
+    num_paths: int = 10000,
+    block_size: int = 20,
+    sample_every: int = 21,
+    percentiles: Sequence[float] = (5, 25, 50, 75, 95),
+    seed: Optional[int] = None,
+    processes: Optional[int] = None,
+    max_values_per_chunk: int = MAX_VALUES_PER_CHUNK,
+) -> List[DateAndPercentiles]:
+    """
+    Simulates the value of the portfolio's final holdings for `num_years`
+    after `history_end` by block-bootstrapping the daily returns observed
+    between `history_start` and `history_end`, inclusive.
+
+    Returns the requested percentiles of the simulated value every
+    `sample_every` trading days. The same `seed` always produces the same
+    result, regardless of `processes` and `max_values_per_chunk`.
+
+    Raises ValueError if `num_years` or `num_paths` is out of bounds.
+    """
+    num_days = int(num_years * TRADING_DAYS_PER_YEAR)
+    if not 1 <= num_days <= MAX_YEARS * TRADING_DAYS_PER_YEAR:
+        raise ValueError(
+            f"num_years must be between {1 / TRADING_DAYS_PER_YEAR:.4f} and "
+            f"{MAX_YEARS}, got {num_years}."
+        )
+    if not 1 <= num_paths <= MAX_PATHS:
+        raise ValueError(
+            f"num_paths must be between 1 and {MAX_PATHS}, got {num_paths}."
+        )
+
+    holdings = get_holdings(portfolio)
+    tickers = sorted(t for t, volume in holdings.items() if volume != 0)
+    if not tickers:
+        raise ValueError("The portfolio does not hold any stock to simulate.")
+    prices = PriceMatrix.load(tickers, history_start, history_end, finance_cache)
+
+    # Only use days on which every ticker has a close.
+    closes = prices.close[~np.isnan(prices.close).any(axis=1)]
+    log_returns = np.diff(np.log(closes), axis=0)
+    if len(log_returns) < block_size:
+        raise ValueError(
+            f"Need at least {block_size + 1} days with data for every ticker "
+            f"to simulate, found {len(closes)}."
+        )
+
+    sample_days = np.arange(sample_every - 1, num_days, sample_every)
+    if len(sample_days) == 0 or sample_days[-1] != num_days - 1:
+        sample_days = np.append(sample_days, num_days - 1)
+    inputs = _SimulationInputs(
+        log_returns=log_returns,
+        start_values=np.array([holdings[t] for t in tickers]) * closes[-1],
+        cash=get_cash(portfolio),
+        num_days=num_days,
+        block_size=block_size,
+        sample_days=sample_days,
+    )
+
+    # Bound memory by the number of simulated days rather than paths.
+    chunk_size = max(max_values_per_chunk // num_days, 1)
+    first_paths = list(range(0, num_paths, chunk_size))
+    chunk_sizes = [min(chunk_size, num_paths - first) for first in first_paths]
+    entropy = np.random.SeedSequence(seed).entropy
+    processes = min(processes or os.cpu_count() or 1, len(chunk_sizes))
+    if processes <= 1:
+        values = [
+            _simulate_chunk(inputs, entropy, first, n)
+            for first, n in zip(first_paths, chunk_sizes)
+        ]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            values = list(
+                executor.map(
+                    _simulate_chunk,
+                    [inputs] * len(chunk_sizes),
+                    [entropy] * len(chunk_sizes),
+                    first_paths,
+                    chunk_sizes,
+                )
+            )
+
+    bands = np.percentile(np.concatenate(values), percentiles, axis=0)
+    sample_dates = np.busday_offset(
+        np.datetime64(history_end, "D"), sample_days + 1, roll="forward"
+    )
+    return [
+        DateAndPercentiles(
+            day.astype(date), {p: float(v) for p, v in zip(percentiles, band)}
+        )
+        for day, band in zip(sample_dates, bands.T)
+    ]